@@ -12,7 +12,7 @@ class RunMode(Enum):
     """
     RunMode affects how the pipeline is run.
 
-    waterfall: beakers are processed one at a time, based on a topological sort of the graph
+    waterfall: beakers are processed in order, based on a topological sort of the graph
     river: beakers are processed in parallel, with items flowing downstream
     """
 
@@ -1,11 +1,9 @@
 import abc
-import json
 import uuid
 import pathlib
 from pydantic import BaseModel
 from typing import Iterable, Type, TYPE_CHECKING
 from structlog import get_logger
-from sqlite_utils.db import NotFoundError
 from .exceptions import ItemNotFound
 
 if TYPE_CHECKING:  # pragma: no cover
@@ -57,6 +55,18 @@ class Beaker(abc.ABC):
         Return iterable of items in the beaker.
         """
 
+    def unprocessed_items(
+        self, out_beakers: Iterable["Beaker"]
+    ) -> Iterable[tuple[str, BaseModel]]:
+        """
+        Return iterable of items that are not the parent of an item in any
+        of out_beakers.
+        """
+        processed: set[str] = set()
+        for beaker in out_beakers:
+            processed |= beaker.parent_id_set()
+        return ((id, item) for id, item in self.items() if id not in processed)
+
     @abc.abstractmethod
     def get_item(self, id: str) -> BaseModel:
         """
@@ -71,6 +81,15 @@ class Beaker(abc.ABC):
         Add an item to the beaker.
         """
 
+    def add_items(self, items: Iterable[BaseModel], *, parent: str | None) -> None:
+        """
+        Add many items to the beaker, all sharing the same parent.
+
+        Subclasses may override this to write items in bulk.
+        """
+        for item in items:
+            self.add_item(item, parent=parent, id_=None)
+
     @abc.abstractmethod
     def delete(
         self, *, parent: list[str] | None = None, ids: list[str] | None = None
@@ -161,34 +180,59 @@ class SqliteBeaker(Beaker):
     def __len__(self) -> int:
         return self._table.count
 
+    # these iterate the sqlite3 cursor directly, rows are streamed as plain
+    # tuples rather than being materialized as dicts by rows_where
+
     def parent_id_set(self) -> set[str]:
-        return {row["parent"] for row in self._table.rows_where(select="parent")}
+        return {
+            parent
+            for (parent,) in self._table.db.execute(
+                f"SELECT DISTINCT parent FROM [{self.name}]"
+            )
+        }
 
     def all_ids(
         self, ordered: bool = False, where: dict[str, str] | None = None
     ) -> Iterable[str]:
+        sql = f"SELECT uuid FROM [{self.name}]"
+        where_vals: list[str] = []
         if where:
-            where_str = " and ".join(
+            sql += " WHERE " + " and ".join(
                 [f"json_extract(data, '$.{k}') = ?" for k in where.keys()]
             )
             where_vals = list(where.values())
-            rows = self._table.rows_where(where_str, where_vals, select="uuid")
-        else:
-            rows = self._table.rows_where(select="uuid")
-        ids = [row["uuid"] for row in rows]
         if ordered:
-            ids = sorted(ids)
-        return ids
+            sql += " ORDER BY uuid"
+        return [id for (id,) in self._table.db.execute(sql, where_vals)]
 
     def all_ids_and_parents(self) -> Iterable[tuple[str, str]]:
-        return (
-            (row["uuid"], row["parent"])
-            for row in self._table.rows_where(select="uuid, parent")
-        )
+        return self._table.db.execute(f"SELECT uuid, parent FROM [{self.name}]")
 
     def items(self) -> Iterable[tuple[str, BaseModel]]:
-        for item in self._table.rows_where(select="uuid, data"):
-            yield item["uuid"], self.model(**json.loads(item["data"]))
+        for id, data in self._table.db.execute(f"SELECT uuid, data FROM [{self.name}]"):
+            yield id, self.model.model_validate_json(data)
+
+    def unprocessed_items(
+        self, out_beakers: Iterable[Beaker]
+    ) -> Iterable[tuple[str, BaseModel]]:
+        # beakers in the same database are filtered by SQLite,
+        # any others are checked against their parent ids
+        not_exists = []
+        processed: set[str] = set()
+        for beaker in out_beakers:
+            if isinstance(beaker, SqliteBeaker) and beaker.pipeline is self.pipeline:
+                not_exists.append(
+                    f"NOT EXISTS (SELECT 1 FROM [{beaker.name}] t "
+                    "WHERE t.parent = f.uuid)"
+                )
+            else:
+                processed |= beaker.parent_id_set()
+        where = " AND ".join(not_exists) or "1=1"
+        for id, data in self._table.db.execute(
+            f"SELECT f.uuid, f.data FROM [{self.name}] f WHERE {where}"
+        ):
+            if id not in processed:
+                yield id, self.model.model_validate_json(data)
 
     def add_item(
         self, item: BaseModel, *, parent: str | None, id_: str | None = None
@@ -214,12 +258,31 @@ class SqliteBeaker(Beaker):
             (id_, parent, item.model_dump_json()),
         )
 
+    def add_items(self, items: Iterable[BaseModel], *, parent: str | None) -> None:
+        rows = []
+        for item in items:
+            if not hasattr(item, "model_dump_json"):
+                raise TypeError(
+                    f"beaker {self.name} received {item!r} ({type(item)}), "
+                    f"expecting an instance of {self.model}"
+                )
+            id_ = str(uuid.uuid1())
+            rows.append((id_, parent or id_, item.model_dump_json()))
+        log.debug("add_items", count=len(rows), parent=parent, beaker=self.name)
+        self._table.db.conn.executemany(
+            f"INSERT INTO {self.name} (uuid, parent, data) VALUES (?, ?, ?)",
+            rows,
+        )
+
     def get_item(self, id: str) -> BaseModel:
-        try:
-            row = self._table.get(id)
-        except NotFoundError:
+        # direct query instead of Table.get, which introspects the table
+        # on every call, this lets sqlite3 reuse its cached statement
+        row = self._table.db.execute(
+            f"SELECT data FROM [{self.name}] WHERE uuid = ?", (id,)
+        ).fetchone()
+        if row is None:
             raise ItemNotFound(f"{id} not found in {self.name}")
-        return self.model(**json.loads(row["data"]))
+        return self.model.model_validate_json(row[0])
 
     def delete(
         self, *, parent: list[str] | None = None, ids: list[str] | None = None
@@ -77,9 +77,10 @@ def show(
         if count_processed:
             table.add_column("Processed", justify="right")
         table.add_column("Edges")
+        lengths = ctx.obj._beaker_lengths()
         for node in sorted(ctx.obj._beakers_toposort(None)):
             beaker = ctx.obj.beakers[node]
-            length = len(beaker)
+            length = lengths[node]
             if not length and not empty:
                 empty_count += 1
                 continue
@@ -91,12 +92,11 @@ def show(
             edge_string = Text()
             first = True
             processed = set()
-            for _, _, e in ctx.obj.graph.out_edges(node, data=True):
+            for edge in ctx.obj._out_edges(node):
                 if not first:
                     edge_string.append("\n")
                 first = False
 
-                edge = e["edge"]
                 if count_processed:
                     processed |= ctx.obj._all_upstream_ids(edge)
 
@@ -178,17 +178,24 @@ def seeds(ctx: typer.Context) -> None:
     """
     List the available seeds and their status.
     """
+    # build output up front, a pipeline may have many seed runs
+    lines = []
     for beaker, seeds in ctx.obj.list_seeds().items():
         for seed, runs in seeds.items():
-            print(
-                Text(f"{seed:<30}", style="bright"),
-                Text(f"(-> {beaker})", style="dim", justify="right"),
+            lines.append(
+                typer.style(f"{seed:<30}", bold=True)
+                + " "
+                + typer.style(f"(-> {beaker})", dim=True)
             )
             for run in runs:
-                typer.secho(
-                    f"    {run}",
-                    fg=typer.colors.RED if run.error else typer.colors.GREEN,
+                lines.append(
+                    typer.style(
+                        f"    {run}",
+                        fg=typer.colors.RED if run.error else typer.colors.GREEN,
+                    )
                 )
+    if lines:
+        typer.echo("\n".join(lines))
 
 
 @app.command()
@@ -268,8 +275,11 @@ def clear(
         if not reset_list:
             typer.secho("Nothing to reset!", fg=typer.colors.YELLOW)
             raise typer.Exit(1)
-        for item in reset_list:
-            typer.secho(f"Reset {item}", fg=typer.colors.RED)
+        typer.echo(
+            "\n".join(
+                typer.style(f"Reset {item}", fg=typer.colors.RED) for item in reset_list
+            )
+        )
         return
 
     if not beaker_name:
@@ -448,8 +458,15 @@ def repair(
         typer.secho("Dry run; no changes will be made!", fg=typer.colors.YELLOW)
     if not repaired:
         typer.secho("Nothing to repair!", fg=typer.colors.GREEN)
-    for beaker, changes in repaired.items():
-        typer.secho(f"removed {len(changes)} from {beaker}", fg=typer.colors.RED)
+    if repaired:
+        typer.echo(
+            "\n".join(
+                typer.style(
+                    f"removed {len(changes)} from {beaker}", fg=typer.colors.RED
+                )
+                for beaker, changes in repaired.items()
+            )
+        )
     if dry_run:
         typer.secho("Dry run; no changes made!", fg=typer.colors.YELLOW)
 
@@ -8,18 +8,33 @@ from ._utils import callable_name
 log = get_logger()
 
 
+def _reserve_call(last_call: float | None, requests_per_second: float) -> float:
+    """
+    Return the monotonic time at which the next call may be made.
+
+    Callers store the result as their new last_call before sleeping, so
+    concurrent callers each reserve their own slot instead of all waking
+    at once.
+    """
+    now = time.monotonic()
+    if last_call is None:
+        return now
+    return max(now, last_call + 1 / requests_per_second)
+
+
 def rate_limit(edge_func, requests_per_second=1):
     last_call = None
 
     @functools.wraps(edge_func)
     async def new_func(item):
         nonlocal last_call
-        if last_call is not None:
-            diff = (1 / requests_per_second) - (time.time() - last_call)
-            if diff > 0:
-                log.debug("rate_limit sleep", seconds=diff, last_call=last_call)
-                await asyncio.sleep(diff)
-        last_call = time.time()
+        last_call = _reserve_call(last_call, requests_per_second)
+        diff = last_call - time.monotonic()
+        if diff > 0:
+            log.debug("rate_limit sleep", seconds=diff, last_call=last_call)
+            await asyncio.sleep(diff)
+            # account for oversleeping, unless a later slot was reserved
+            last_call = max(last_call, time.monotonic())
         result = edge_func(item)
         if inspect.isawaitable(result):
             return await result
@@ -50,17 +65,17 @@ def adaptive_rate_limit(
         nonlocal successes_counter
         nonlocal requests_per_second
 
-        if last_call is not None:
-            diff = (1 / requests_per_second) - (time.time() - last_call)
-            if diff > 0:
-                log.debug(
-                    "adaptive_rate_limit sleep",
-                    seconds=diff,
-                    last_call=last_call,
-                    streak=successes_counter,
-                )
-                await asyncio.sleep(diff)
-        last_call = time.time()
+        last_call = _reserve_call(last_call, requests_per_second)
+        diff = last_call - time.monotonic()
+        if diff > 0:
+            log.debug(
+                "adaptive_rate_limit sleep",
+                seconds=diff,
+                last_call=last_call,
+                streak=successes_counter,
+            )
+            await asyncio.sleep(diff)
+            last_call = max(last_call, time.monotonic())
 
         try:
             result = edge_func(item)
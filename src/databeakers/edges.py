@@ -1,8 +1,8 @@
 import abc
 import inspect
 from operator import attrgetter
-from typing import AsyncGenerator, Callable, Generator
-from pydantic import BaseModel
+from typing import AsyncGenerator, Callable, Generator, NamedTuple
+from pydantic import BaseModel, PrivateAttr
 from structlog import get_logger
 from databeakers.exceptions import NoEdgeResult, BadSplitResult
 from databeakers._models import ErrorType
@@ -14,7 +14,14 @@ log = get_logger()
 DEST_STOP = "__stop"  # sentinel value for stopping the pipeline
 
 
-class EdgeResult(BaseModel):
+class EdgeResult(NamedTuple):
+    """
+    Result of running an edge on a single item.
+
+    A NamedTuple rather than a model since one is created per item,
+    data is validated when added to a beaker.
+    """
+
     dest: str
     data: BaseModel | None
     id_: str | None
@@ -46,6 +53,7 @@ class Transform(Edge):
     error_map: dict[tuple, str]
     name: str | None = None
     allow_filter: bool = False
+    _error_dispatch: dict[type, str | None] = PrivateAttr(default_factory=dict)
 
     def __init__(
         self,
@@ -79,21 +87,16 @@ class Transform(Edge):
                 result = await result
         except Exception as e:
             lg = lg.bind(exception=repr(e))
-            for (
-                error_types,
-                error_beaker_name,
-            ) in self.error_map.items():
-                if isinstance(e, error_types):
-                    lg.info("edge error", error_beaker=error_beaker_name)
-                    yield EdgeResult(
-                        dest=error_beaker_name,
-                        data=ErrorType(
-                            item=data, exception=str(e), exc_type=str(type(e))
-                        ),
-                        id_=id_,
-                    )
-                    # done after one error
-                    return
+            error_beaker_name = self._error_beaker(type(e))
+            if error_beaker_name is not None:
+                lg.info("edge error", error_beaker=error_beaker_name)
+                yield EdgeResult(
+                    dest=error_beaker_name,
+                    data=ErrorType(item=data, exception=str(e), exc_type=str(type(e))),
+                    id_=id_,
+                )
+                # done after one error
+                return
             else:
                 # no error handler, re-raise
                 lg.critical("edge exception", exception=str(e))
@@ -126,6 +129,22 @@ class Transform(Edge):
         else:
             raise NoEdgeResult("transform returned None")
 
+    def _error_beaker(self, exc_type: type[Exception]) -> str | None:
+        """
+        Return the error beaker for an exception type, or None if unhandled.
+
+        Matches are cached per exception type so error_map is only scanned
+        the first time a given type is raised.
+        """
+        if exc_type not in self._error_dispatch:
+            for error_types, error_beaker_name in self.error_map.items():
+                if issubclass(exc_type, error_types):
+                    break
+            else:
+                error_beaker_name = None
+            self._error_dispatch[exc_type] = error_beaker_name
+        return self._error_dispatch[exc_type]
+
     def out_beakers(self) -> set[str]:
         return {self.to_beaker} | set(self.error_map.values())
 
@@ -169,7 +188,6 @@ class Splitter(Edge):
         lg = log.bind(edge=self.name, edge_type="splitter", id_=id_)
         try:
             result = self.func(data)
-            lg = lg.bind(splitter_result=result)
         except Exception as e:
             lg.critical(
                 "splitter exception",
@@ -177,13 +195,15 @@ class Splitter(Edge):
             )
             raise
 
-        if result not in self.splitter_map:
-            lg.critical("splitter bad result")
+        # single lookup, this runs once per item
+        transform = self.splitter_map.get(result)
+        if transform is None:
+            lg.critical("splitter bad result", splitter_result=result)
             raise BadSplitResult(
                 f"splitter result {result} not in splitter map {self.splitter_map}"
             )
-        lg.info("splitter dispatch")
-        async for item in self.splitter_map[result]._run(id_, data):
+        lg.info("splitter dispatch", splitter_result=result)
+        async for item in transform._run(id_, data):
             yield item
 
     def out_beakers(self) -> set[str]:
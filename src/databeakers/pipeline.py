@@ -1,3 +1,4 @@
+import time
 import inspect
 import asyncio
 import datetime
@@ -5,7 +6,7 @@ import itertools
 import networkx  # type: ignore
 import pydot
 from collections import defaultdict
-from typing import Any, Iterable, Callable, Type, Generator
+from typing import Any, Awaitable, Iterable, Callable, Type, Generator, TypeVar
 from types import UnionType
 from pydantic import BaseModel
 from structlog import get_logger
@@ -21,18 +22,47 @@ from .exceptions import ItemNotFound, SeedError, InvalidGraph
 
 
 log = get_logger()
+T = TypeVar("T")
+# SQLite's default limit on the number of terms in a compound SELECT
+MAX_COMPOUND_SELECT = 500
+
+
+async def _gather_or_cancel(*coros: Awaitable[T]) -> list[T]:
+    """
+    Like asyncio.gather, but cancels the remaining tasks if one raises.
+    """
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except Exception:
+        for task in tasks:
+            task.cancel()
+        # wait for cancellations so nothing is left pending on the loop
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
 
 
 class Pipeline:
-    def __init__(self, name: str, db_name: str = "beakers.db", *, num_workers: int = 1):
+    def __init__(
+        self,
+        name: str,
+        db_name: str = "beakers.db",
+        *,
+        num_workers: int = 1,
+        chunk_size: int = 1000,
+        commit_interval: float = 1.0,
+    ):
         self.name = name
         self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self.commit_interval = commit_interval
         self.graph = networkx.DiGraph()
         self.beakers: dict[str, Beaker] = {}
         self.seeds: dict[str, Seed] = {}
         self._db = Database(memory=True) if db_name == ":memory:" else Database(db_name)
         self._db.enable_wal()
         self._db.execute("PRAGMA synchronous=1;")
+        self._db.execute("PRAGMA temp_store=MEMORY;")
         self._db.conn.isolation_level = None
         self._seeds_t = self._db.table("_seed_runs").create(
             pydantic_to_schema(SeedRun),
@@ -40,10 +70,34 @@ class Pipeline:
             if_not_exists=True,
         )
         self._cached_upstream_ids: dict[int, set[str]] = defaultdict(set)
+        self._cached_parent_ids: dict[str, set[str]] = {}
+        # event loop used for all async work in a run, only open during run()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        # state of the open write batch during a run, see _begin_batch
+        self._batch_items = 0
+        self._batch_start = 0.0
+        self._batch_flush: asyncio.TimerHandle | None = None
+        # graph structure caches, reset whenever the graph changes
+        self._cached_toposort: list[str] | None = None
+        self._cached_generations: list[list[str]] | None = None
+        self._cached_out_edges: dict[str, tuple[Edge, ...]] = {}
 
     def __repr__(self) -> str:
         return f"Pipeline({self.name})"
 
+    def __enter__(self) -> "Pipeline":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Close the pipeline's event loop (if open) and database connection.
+        """
+        self._close_loop()
+        self._db.close()
+
     # section: seeds ##########################################################
 
     def register_seed(
@@ -82,19 +136,20 @@ class Pipeline:
         Get all runs for a seed.
         """
         return list(
-            pyd_wrap(self._seeds_t.rows_where("seed_name = ?", [seed_name]), SeedRun)
+            pyd_wrap(
+                self._db.query(
+                    "SELECT * FROM _seed_runs WHERE seed_name = ?", [seed_name]
+                ),
+                SeedRun,
+            )
         )
 
     def get_seed_run(self, run_repr: str) -> SeedRun | None:
         """
         Get a single run by its representation.
         """
-        try:
-            return list(
-                pyd_wrap(self._seeds_t.rows_where("run_repr = ?", [run_repr]), SeedRun)
-            )[0]
-        except IndexError:
-            return None
+        rows = self._db.query("SELECT * FROM _seed_runs WHERE run_repr = ?", [run_repr])
+        return next(iter(pyd_wrap(rows, SeedRun)), None)
 
     def run_seed(
         self,
@@ -152,14 +207,17 @@ class Pipeline:
 
         try:
             for chunk in chunks(seed.func(**parameters), chunk_size):
+                # materialize chunk first, tail items won't be saved on error
+                # (stop pulling from the seed once max_items is reached)
+                if max_items:
+                    items = list(itertools.islice(chunk, max_items - num_items))
+                else:
+                    items = list(chunk)
                 # transaction per chunk
                 with self._db.conn:
                     self._db.execute("BEGIN TRANSACTION")
-                    for item in chunk:
-                        beaker.add_item(item, parent=run_repr, id_=None)
-                        num_items += 1
-                        if num_items == max_items:
-                            break
+                    beaker.add_items(items, parent=run_repr)
+                num_items += len(items)
                 if num_items == max_items:
                     break
         except Exception as e:
@@ -168,9 +226,6 @@ class Pipeline:
             if not save_bad_runs:
                 self.delete_from_beaker(seed.beaker_name, parent=[run_repr])
                 num_items = 0
-            else:
-                # tail items won't be saved
-                num_items -= num_items % chunk_size
 
         end_time = datetime.datetime.utcnow()
         sr = SeedRun(
@@ -202,7 +257,18 @@ class Pipeline:
             datatype: type of data stored in beaker
             beaker_type: type of beaker to use (default: SqliteBeaker)
         """
+        existing = self.beakers.get(name)
+        if existing is not None:
+            # re-declaring would discard a TempBeaker's items or
+            # swap out a typed beaker, only allow identical declarations
+            if type(existing) is beaker_type and existing.model == datatype:
+                return existing
+            raise InvalidGraph(
+                f"Beaker {name} already exists as {existing!r}, "
+                f"cannot redeclare as {beaker_type.__name__}({name}, {datatype.__name__})"
+            )
         self.graph.add_node(name, datatype=datatype, node_type="beaker")
+        self._clear_graph_cache()
         self.beakers[name] = beaker_type(name, datatype, self)
         return self.beakers[name]
 
@@ -345,6 +411,7 @@ class Pipeline:
             edge.to_beaker,
             edge=edge,
         )
+        self._clear_graph_cache()
         return edge
 
     def add_splitter(self, from_beaker: str, splitter: Splitter) -> None:
@@ -358,6 +425,7 @@ class Pipeline:
                 out.to_beaker,
                 edge=splitter,
             )
+        self._clear_graph_cache()
 
     # section: running ########################################################
 
@@ -369,11 +437,14 @@ class Pipeline:
         """
         Run the pipeline.
 
-        In a waterfall run, beakers are processed one at a time, based on a
+        In a waterfall run, beakers are processed in generations, based on a
         topological sort of the graph.
 
         This means any beaker without dependencies will be processed first,
         followed by beakers that depend on those beakers, and so on.
+        Beakers within a generation do not depend on one another, so they
+        are processed concurrently, sharing up to num_workers items in flight
+        across the whole generation.
 
         Args:
             only_beakers: If provided, only run these beakers.
@@ -388,48 +459,133 @@ class Pipeline:
 
         # hack: clear graph's cache so run can be used multiple times
         self._cached_upstream_ids = {}
+        self._cached_parent_ids = {}
 
-        # go through each node in forward order
-        if run_mode == RunMode.waterfall:
-            return self._run_waterfall(only_beakers, report)
-        elif run_mode == RunMode.river:
-            return self._run_river(only_beakers, report)
-        else:
-            raise ValueError(f"Unknown run mode {run_mode}")  # pragma: no cover
+        # one event loop is reused for all async work in the run
+        self._loop = asyncio.new_event_loop()
+        try:
+            # go through each node in forward order
+            if run_mode == RunMode.waterfall:
+                return self._run_waterfall(only_beakers, report)
+            elif run_mode == RunMode.river:
+                return self._run_river(only_beakers, report)
+            else:
+                raise ValueError(f"Unknown run mode {run_mode}")  # pragma: no cover
+        finally:
+            self._close_loop()
+
+    def _run_async(self, coro: Awaitable[T]) -> T:
+        assert self._loop is not None, "event loop is only available during run()"
+        return self._loop.run_until_complete(coro)
+
+    def _close_loop(self) -> None:
+        """
+        Cancel and drain any pending tasks, then close the event loop.
+        """
+        if self._loop is None:
+            return
+        pending = asyncio.all_tasks(self._loop)
+        for task in pending:
+            task.cancel()
+        if pending:
+            self._loop.run_until_complete(
+                asyncio.gather(*pending, return_exceptions=True)
+            )
+        self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+        self._loop.close()
+        self._loop = None
+
+    def _begin_batch(self) -> None:
+        """
+        Open a write batch if one isn't already open, items are then
+        committed together instead of one write at a time.
+
+        Called right before writing, so the database is only locked
+        once there is something to commit.
+        """
+        if not self._db.conn.in_transaction:
+            self._db.execute("BEGIN TRANSACTION")
+            self._batch_items = 0
+            self._batch_start = time.monotonic()
+
+    def _commit_batch(self) -> None:
+        if self._batch_flush is not None:
+            self._batch_flush.cancel()
+            self._batch_flush = None
+        self._db.conn.commit()
+
+    def _batch_item_done(self) -> None:
+        """
+        Count a completed item, committing the open batch every chunk_size
+        items or commit_interval seconds, whichever comes first.
+
+        A timer also commits the batch while transforms are awaited, so the
+        database isn't left locked between slow items.
+        """
+        if not self._db.conn.in_transaction:
+            return
+        self._batch_items += 1
+        elapsed = time.monotonic() - self._batch_start
+        if self._batch_items >= self.chunk_size or elapsed >= self.commit_interval:
+            self._commit_batch()
+        elif self._batch_flush is None:
+            self._batch_flush = asyncio.get_running_loop().call_later(
+                self.commit_interval - elapsed, self._commit_batch
+            )
 
     def _run_waterfall(
         self, only_beakers: list[str] | None, report: RunReport
     ) -> RunReport:
-        for node in self._beakers_toposort(only_beakers):
-            # push data from this node to downstream nodes
-            report.nodes[node] = self._run_node_waterfall(node)
+        for generation in self._beakers_generations(only_beakers):
+            # beakers in the same generation don't depend on one another,
+            # so their data is pushed downstream concurrently
+            node_reports = self._run_async(self._run_generation_waterfall(generation))
+            for node, node_report in zip(generation, node_reports):
+                report.nodes[node] = node_report
 
         return report
 
-    def _run_node_waterfall(self, node: str) -> dict[str, int]:
+    async def _run_generation_waterfall(self, nodes: list[str]) -> list[dict[str, int]]:
+        """
+        Run a generation of independent nodes in a waterfall run.
+        """
+        # num_workers limits items in flight across the whole generation,
+        # not per beaker
+        semaphore = asyncio.Semaphore(self.num_workers)
+        # completed items are committed in batches, even if a later item raises
+        try:
+            return await _gather_or_cancel(
+                *(self._run_node_waterfall(node, semaphore) for node in nodes)
+            )
+        finally:
+            self._commit_batch()
+
+    async def _run_node_waterfall(
+        self, node: str, semaphore: asyncio.Semaphore
+    ) -> dict[str, int]:
         """
         Run a single node in a waterfall run, returning a report of items dispatched.
         """
-        loop = asyncio.new_event_loop()
         # store count of dispatched items
         node_report: dict[str, int] = defaultdict(int)
 
         # get outbound edges
         for edge in self._out_edges(node):
             from_beaker = self.beakers[node]
-            all_upstream = self._all_upstream_ids(edge)
-            already_processed = set(from_beaker.all_ids()) & all_upstream
-            node_report["_already_processed"] = len(already_processed)
+            out_beakers = [self.beakers[b] for b in edge.out_beakers()]
+            to_process = list(from_beaker.unprocessed_items(out_beakers))
+            already_processed = len(from_beaker) - len(to_process)
+            node_report["_already_processed"] = already_processed
 
             log.info(
                 "processing edge",
                 from_b=from_beaker.name,
                 edge=edge.name,
-                to_process=len(from_beaker) - len(already_processed),
-                already_processed=len(already_processed),
+                to_process=len(to_process),
+                already_processed=already_processed,
             )
-            partial_result = loop.run_until_complete(
-                self._run_edge_waterfall(from_beaker, edge, already_processed)
+            partial_result = await self._run_edge_waterfall(
+                from_beaker, edge, to_process, semaphore
             )
             for k, v in partial_result.items():
                 node_report[k] += v
@@ -440,15 +596,14 @@ class Pipeline:
         self,
         from_beaker: Beaker,
         edge: Edge,
-        already_processed: set[str],
+        to_process: Iterable[tuple[str, BaseModel]],
+        semaphore: asyncio.Semaphore,
     ) -> dict[str, int]:
-        queue: asyncio.Queue[tuple[str, Record]] = asyncio.Queue()
+        queue: asyncio.Queue[tuple[str, BaseModel]] = asyncio.Queue()
         node_report: dict[str, int] = defaultdict(int)
 
         # enqueue all items
-        for id, item in from_beaker.items():
-            if id in already_processed:
-                continue
+        for id, item in to_process:
             queue.put_nowait((id, item))
 
         log.debug("edge queue populated", edge=edge.name, queue_len=queue.qsize())
@@ -464,12 +619,12 @@ class Pipeline:
                 log.debug("task accepted", worker=name, id=id, edge=edge.name)
 
                 try:
-                    # transaction around each waterfall step
-                    with self._db.conn:
+                    async with semaphore:
                         result_loc = await self._run_edge_func(
                             from_beaker.name, edge, id, item=item
                         )
                     node_report[result_loc] += 1
+                    self._batch_item_done()
                 except Exception:
                     # uncaught exception, log and re-raise
                     result_loc = "UNCAUGHT_EXCEPTION"
@@ -485,24 +640,27 @@ class Pipeline:
 
         # wait until the queue is fully processed or a worker raises
         queue_complete = asyncio.create_task(queue.join())
-        await asyncio.wait(
-            [queue_complete, *workers], return_when=asyncio.FIRST_COMPLETED
-        )
-
-        # cancel any remaining workers and pull exception to raise
-        to_raise = None
-        for w in workers:
-            if not w.done():
-                w.cancel()
-            else:
-                to_raise = w.exception()
-        if to_raise:
-            raise to_raise
+        try:
+            await asyncio.wait(
+                [queue_complete, *workers], return_when=asyncio.FIRST_COMPLETED
+            )
+            # pull exception to raise from any finished worker
+            to_raise = None
+            for w in workers:
+                if w.done() and not w.cancelled():
+                    to_raise = w.exception()
+            if to_raise:
+                raise to_raise
+        finally:
+            # always cancel remaining workers, even if this edge was cancelled,
+            # so none are left running on the pipeline's loop
+            pending = [t for t in (queue_complete, *workers) if not t.done()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
         return node_report
 
     def _run_river(self, only_beakers, report: RunReport) -> RunReport:
-        loop = asyncio.new_event_loop()
-
         # start beaker is the first beaker in the topological sort that's in only_beakers
         start_b = list(self._beakers_toposort(only_beakers))[0]
         log.debug("starting river run", start_beaker=start_b, only_beakers=only_beakers)
@@ -522,20 +680,42 @@ class Pipeline:
             all_ids=len(all_ids),
             unprocessed=len(unprocessed),
         )
-        for id in unprocessed:
-            # transaction around river runs
-            with self._db.conn:
-                record = self._get_full_record(id)
-                log.debug("river record", id=id)
-                for from_b, to_b in loop.run_until_complete(
-                    self._run_one_item_river(record, start_b, only_beakers)
+        for chunk in chunks(unprocessed, self.chunk_size):
+            # like waterfall runs, completed items are committed in batches
+            # even if a later item raises
+            try:
+                for from_b, to_b in self._run_async(
+                    self._run_river_chunk(chunk, start_b, only_beakers)
                 ):
                     report.nodes[from_b][to_b] += 1
+            finally:
+                self._commit_batch()
 
         report.nodes[start_b]["_already_processed"] = len(already_processed)
 
         return report
 
+    async def _run_river_chunk(
+        self, ids: Iterable[str], start_b: str, only_beakers: list[str] | None
+    ) -> list[tuple[str, str]]:
+        """
+        Run a chunk of items through the river, up to num_workers at a time.
+
+        Return list of (from, to) pairs.
+        """
+        semaphore = asyncio.Semaphore(self.num_workers)
+
+        async def run_one(id: str) -> list[tuple[str, str]]:
+            async with semaphore:
+                record = self._get_full_record(id)
+                log.debug("river record", id=id)
+                from_to = await self._run_one_item_river(record, start_b, only_beakers)
+                self._batch_item_done()
+                return from_to
+
+        results = await _gather_or_cancel(*(run_one(id) for id in ids))
+        return [from_to for result in results for from_to in result]
+
     async def _run_edge_func(
         self,
         cur_b: str,
@@ -558,8 +738,11 @@ class Pipeline:
         # figure out what is going to be passed in
         data: BaseModel | Record | None = None
         if edge.whole_record:
-            data = record if record is not None else self._get_full_record(id)
-            record = data
+            if record is None:
+                # item is already loaded, no need to read & validate it again
+                known = {cur_b: item} if item is not None else None
+                record = self._get_full_record(id, known=known)
+            data = record
         else:
             data = item
             if data is None and record:
@@ -571,6 +754,7 @@ class Pipeline:
                 return DEST_STOP
             else:
                 beaker = self.beakers[e_result.dest]
+                self._begin_batch()
                 beaker.add_item(e_result.data, parent=id, id_=e_result.id_)
 
         if record:
@@ -660,8 +844,9 @@ class Pipeline:
         with self._db.conn:
             self._seeds_t.delete_where()
             #    reset_list.append(f"seeds ({seed_count})")
+            lengths = self._beaker_lengths()
             for beaker in self.beakers.values():
-                if bl := len(beaker):
+                if bl := lengths[beaker.name]:
                     log.info("resetting", beaker=beaker.name, count=bl)
                     beaker.delete()
                     reset_list.append(f"{beaker.name} ({bl})")
@@ -747,39 +932,112 @@ class Pipeline:
 
     # section: helper methods ################################################
 
+    def _clear_graph_cache(self) -> None:
+        self._cached_toposort = None
+        self._cached_generations = None
+        self._cached_out_edges = {}
+
     def _beakers_toposort(
         self, only_beakers: list[str] | None
     ) -> Generator[str, None, None]:
-        for node in networkx.topological_sort(self.graph):
-            if self.graph.nodes[node]["node_type"] == "split":
-                continue
-            elif only_beakers and node not in only_beakers:
+        if self._cached_toposort is None:
+            self._cached_toposort = [
+                node
+                for node in networkx.topological_sort(self.graph)
+                if self.graph.nodes[node]["node_type"] != "split"
+            ]
+        for node in self._cached_toposort:
+            if only_beakers and node not in only_beakers:
                 continue
             else:
                 yield node
 
-    def _out_edges(self, cur_b):
-        for _, _, e in self.graph.out_edges(cur_b, data=True):
-            yield e["edge"]
+    def _beakers_generations(self, only_beakers: list[str] | None) -> list[list[str]]:
+        """
+        Group beakers into topological generations, no beaker depends
+        on another beaker in the same generation.
+        """
+        if self._cached_generations is None:
+            self._cached_generations = [
+                [
+                    node
+                    for node in generation
+                    if self.graph.nodes[node]["node_type"] != "split"
+                ]
+                for generation in networkx.topological_generations(self.graph)
+            ]
+        generations = []
+        for generation in self._cached_generations:
+            nodes = [n for n in generation if not only_beakers or n in only_beakers]
+            if nodes:
+                generations.append(nodes)
+        return generations
+
+    def _beaker_lengths(self) -> dict[str, int]:
+        """
+        Return the number of items in each beaker.
+
+        SqliteBeakers are counted with a single query per batch of
+        MAX_COMPOUND_SELECT beakers.
+        """
+        lengths = {}
+        names = []
+        for name, beaker in self.beakers.items():
+            if isinstance(beaker, SqliteBeaker) and beaker.pipeline is self:
+                names.append(name)
+            else:
+                lengths[name] = len(beaker)
+        for chunk in chunks(names, MAX_COMPOUND_SELECT):
+            batch = list(chunk)
+            sql = " UNION ALL ".join(
+                f"SELECT ?, COUNT(*) FROM [{name}]" for name in batch
+            )
+            lengths.update(self._db.execute(sql, batch).fetchall())
+        return lengths
+
+    def _out_edges(self, cur_b: str) -> tuple[Edge, ...]:
+        if cur_b not in self._cached_out_edges:
+            self._cached_out_edges[cur_b] = tuple(
+                e["edge"] for _, _, e in self.graph.out_edges(cur_b, data=True)
+            )
+        return self._cached_out_edges[cur_b]
 
     def _all_upstream_ids(self, edge: Edge):
         if id(edge) not in self._cached_upstream_ids:
             all_upstream = set()
-            for error_b in edge.out_beakers():
-                all_upstream |= self.beakers[error_b].parent_id_set()
+            for out_b in edge.out_beakers():
+                all_upstream |= self._parent_ids(out_b)
             self._cached_upstream_ids[id(edge)] = all_upstream
         return self._cached_upstream_ids[id(edge)]
 
-    def _get_full_record(self, id: str) -> Record:
+    def _parent_ids(self, beaker_name: str) -> set[str]:
+        # beakers such as error beakers are often shared between edges,
+        # only scan each once per run
+        if beaker_name not in self._cached_parent_ids:
+            self._cached_parent_ids[beaker_name] = self.beakers[
+                beaker_name
+            ].parent_id_set()
+        return self._cached_parent_ids[beaker_name]
+
+    def _get_full_record(
+        self, id: str, *, known: dict[str, BaseModel] | None = None
+    ) -> Record:
         """
         Get the full record for a given id.
 
         This isn't the most efficient, but for waterfall runs
         the alternative is to store all records in memory.
+
+        Items in known (beaker name -> item) are used as-is instead
+        of being read from their beakers.
         """
         rec = Record(id=id)
         exists = False
         for beaker_name, beaker in self.beakers.items():
+            if known and beaker_name in known:
+                rec[beaker_name] = known[beaker_name]
+                exists = True
+                continue
             try:
                 rec[beaker_name] = beaker.get_item(id)
                 exists = True
@@ -77,3 +77,40 @@ def test_getitem_missing(beakerCls):
 
     with pytest.raises(ItemNotFound):
         beaker.get_item("missing")
+
+
+@pytest.mark.parametrize("beakerCls", [TempBeaker, SqliteBeaker])
+def test_add_items(beakerCls):
+    pipeline = Pipeline("test", ":memory:")
+    beaker = beakerCls("test", Word, pipeline)
+    beaker.add_items([Word(word="one"), Word(word="two")], parent="sr:a")
+    assert len(beaker) == 2
+    assert beaker.parent_id_set() == {"sr:a"}
+    assert sorted(item.word for _, item in beaker.items()) == ["one", "two"]
+
+
+def test_add_items_bad_type():
+    pipeline = Pipeline("test", ":memory:")
+    beaker = SqliteBeaker("test", Word, pipeline)
+    with pytest.raises(TypeError):
+        beaker.add_items([Word(word="one"), "two"], parent="sr:a")  # type: ignore
+    assert len(beaker) == 0
+
+
+@pytest.mark.parametrize("beakerCls", [TempBeaker, SqliteBeaker])
+@pytest.mark.parametrize("outCls", [TempBeaker, SqliteBeaker])
+def test_unprocessed_items(beakerCls, outCls):
+    pipeline = Pipeline("test", ":memory:")
+    beaker = beakerCls("test", Word, pipeline)
+    out_a = outCls("out_a", Word, pipeline)
+    out_b = outCls("out_b", Word, pipeline)
+    beaker.add_item(Word(word="one"), parent="sr:a", id_="one")
+    beaker.add_item(Word(word="two"), parent="sr:a", id_="two")
+    beaker.add_item(Word(word="three"), parent="sr:a", id_="three")
+    out_a.add_item(Word(word="one"), parent="one", id_="one")
+    out_b.add_item(Word(word="two"), parent="two", id_="two")
+
+    assert list(beaker.unprocessed_items([out_a, out_b])) == [
+        ("three", Word(word="three"))
+    ]
+    assert len(list(beaker.unprocessed_items([]))) == 3
@@ -1,4 +1,5 @@
 import time
+import asyncio
 import pytest
 from databeakers.http import HttpRequest
 from databeakers.decorators import rate_limit, retry, adaptive_rate_limit
@@ -188,3 +189,33 @@ async def test_adaptive_rate_limit_speeds_up():
     await assert_time_diff_between(lambda: arl("x"), 0.1, 0.2)
     # and two more, back to intended speed
     await assert_time_diff_between(lambda: arl("x"), 0.05, 0.1)
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_concurrent_calls():
+    rl = rate_limit(lambda x: x, requests_per_second=10)
+
+    async def five_calls():
+        await asyncio.gather(*(rl(n) for n in range(5)))
+
+    # concurrent calls each wait for their own slot: 0, 0.1, 0.2, 0.3, 0.4
+    await assert_time_diff_between(five_calls, 0.4, 0.5)
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_concurrent_calls_sleep_once(monkeypatch):
+    sleeps = []
+    real_sleep = asyncio.sleep
+
+    async def recording_sleep(seconds):
+        sleeps.append(seconds)
+        await real_sleep(seconds)
+
+    monkeypatch.setattr(asyncio, "sleep", recording_sleep)
+    rl = rate_limit(lambda x: x, requests_per_second=20)
+    await asyncio.gather(*(rl(n) for n in range(4)))
+
+    # first call is immediate, each other call sleeps once until its own slot
+    assert len(sleeps) == 3
+    assert sleeps == sorted(sleeps)
+    assert 0.14 <= sleeps[-1] <= 0.15
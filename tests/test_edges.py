@@ -211,3 +211,21 @@ async def test_conditional_splitter():
         pass
     assert res.dest == "lower"
     assert res.data.word == "banana"
+
+
+def test_transform_error_beaker_dispatch():
+    t = Transform(
+        func=lambda x: x,
+        to_beaker="out",
+        error_map={(KeyError,): "key_errors", (LookupError, ValueError): "errors"},
+    )
+    assert t._error_beaker(KeyError) == "key_errors"
+    assert t._error_beaker(IndexError) == "errors"  # subclass of LookupError
+    assert t._error_beaker(ValueError) == "errors"
+    assert t._error_beaker(ZeroDivisionError) is None
+    assert t._error_dispatch == {
+        KeyError: "key_errors",
+        IndexError: "errors",
+        ValueError: "errors",
+        ZeroDivisionError: None,
+    }
@@ -1,10 +1,13 @@
+import asyncio
+import sqlite3
 from typing import Generator, AsyncGenerator
 import pytest
 import itertools
-from databeakers.pipeline import Pipeline, ErrorType
+from databeakers.pipeline import Pipeline, ErrorType, MAX_COMPOUND_SELECT
 from databeakers.exceptions import InvalidGraph
 from databeakers.edges import Transform, Splitter
 from databeakers._models import RunMode
+from databeakers.beakers import TempBeaker
 from examples import Word, Sentence, fruits
 
 
@@ -12,6 +15,24 @@ def capitalized(word: Word) -> Word:
     return Word(word=word.word.capitalize())  # type: ignore
 
 
+class SlowCapitalized:
+    """async capitalized, records the most calls that were in flight at once"""
+
+    def __init__(self, sleep: float):
+        self.sleep = sleep
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, word: Word) -> Word:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.sleep)
+        finally:
+            self.in_flight -= 1
+        return Word(word=word.word.capitalize())
+
+
 @pytest.fixture
 def wc_pipeline():
     """simple fixture with just beakers"""
@@ -454,3 +475,232 @@ def test_delete_forward_propagate_through_splitter(wc_pipeline):
     wc_pipeline.delete_from_beaker("word", ids=["123", "999"])
     assert len(wc_pipeline.beakers["alpha"]) == 1
     assert len(wc_pipeline.beakers["beta"]) == 0
+
+
+def test_run_waterfall_chunked_commits():
+    p = Pipeline("test", ":memory:", chunk_size=2)
+    p.add_beaker("word", Word)
+    p.add_transform("word", "capitalized", capitalized)
+    for word in ["apple", "banana", "cherry", "durian", "elderberry"]:
+        p.beakers["word"].add_item(Word(word=word), parent=None)
+
+    report = p.run(RunMode.waterfall)
+
+    assert report.nodes["word"]["capitalized"] == 5
+    assert len(p.beakers["capitalized"]) == 5
+    assert not p._db.conn.in_transaction
+
+
+@pytest.mark.parametrize("mode", [RunMode.waterfall, RunMode.river])
+def test_run_commits_batch_while_awaiting(mode, tmp_path):
+    db_path = tmp_path / "beakers.db"
+    seen = []
+
+    async def check_other_connection(word: Word) -> Word:
+        # longer than commit_interval, so earlier items must be committed
+        await asyncio.sleep(0.2)
+        other = sqlite3.connect(db_path, timeout=0)
+        seen.append(other.execute("SELECT COUNT(*) FROM capitalized").fetchone()[0])
+        # raises "database is locked" if the batch is still open
+        other.execute("CREATE TABLE IF NOT EXISTS other (x)")
+        other.close()
+        return Word(word=word.word.capitalize())
+
+    p = Pipeline("test", str(db_path), commit_interval=0.05)
+    p.add_beaker("word", Word)
+    p.add_transform("word", "capitalized", check_other_connection)
+    for word in ["apple", "banana", "cherry"]:
+        p.beakers["word"].add_item(Word(word=word), parent=None)
+
+    p.run(mode)
+
+    assert seen == [0, 1, 2]
+    assert len(p.beakers["capitalized"]) == 3
+    p.close()
+
+
+def test_graph_cache_invalidated(wc_pipeline):
+    assert list(wc_pipeline._beakers_toposort(None)) == ["word", "capitalized"]
+    assert wc_pipeline._out_edges("word") == ()
+    wc_pipeline.add_transform("word", "capitalized", capitalized)
+    wc_pipeline.add_beaker("sentence", Sentence)
+    assert wc_pipeline._out_edges("word")[0].name == "capitalized"
+    assert "sentence" in list(wc_pipeline._beakers_toposort(None))
+
+
+@pytest.mark.parametrize("mode", [RunMode.waterfall, RunMode.river])
+def test_run_num_workers_concurrent(mode):
+    slow_capitalized = SlowCapitalized(0.05)
+    p = Pipeline("test", ":memory:", num_workers=5)
+    p.add_beaker("word", Word)
+    p.add_transform("word", "capitalized", slow_capitalized)
+    for n in range(10):
+        p.beakers["word"].add_item(Word(word=f"word {n}"), parent=None)
+
+    report = p.run(mode)
+    # 10 items, 5 at a time
+    assert slow_capitalized.max_in_flight == 5
+    assert report.nodes["word"]["capitalized"] == 10
+    assert len(p.beakers["capitalized"]) == 10
+
+
+def test_all_upstream_ids_shared_beaker_scanned_once(wc_pipeline, monkeypatch):
+    wc_pipeline.add_beaker("lower", Word)
+    wc_pipeline.add_transform(
+        "word", "capitalized", capitalized, error_map={(ValueError,): "error"}
+    )
+    wc_pipeline.add_transform(
+        "word", "lower", lambda x: x, error_map={(ValueError,): "error"}
+    )
+    error_beaker = wc_pipeline.beakers["error"]
+    calls = 0
+    original = error_beaker.parent_id_set
+
+    def counting_parent_id_set():
+        nonlocal calls
+        calls += 1
+        return original()
+
+    monkeypatch.setattr(error_beaker, "parent_id_set", counting_parent_id_set)
+    for edge in wc_pipeline._out_edges("word"):
+        wc_pipeline._all_upstream_ids(edge)
+    assert calls == 1
+
+
+def test_run_closes_event_loop(wc_pipeline, monkeypatch):
+    wc_pipeline.add_transform("word", "capitalized", capitalized)
+    wc_pipeline.beakers["word"].add_item(Word(word="apple"), parent=None)
+    loops = []
+    new_event_loop = asyncio.new_event_loop
+
+    def recording_new_event_loop():
+        loops.append(new_event_loop())
+        return loops[-1]
+
+    monkeypatch.setattr(asyncio, "new_event_loop", recording_new_event_loop)
+    wc_pipeline.run(RunMode.waterfall)
+    wc_pipeline.run(RunMode.river)
+    # one loop per run, not per node, closed when the run ends
+    assert len(loops) == 2
+    assert all(loop.is_closed() for loop in loops)
+    assert wc_pipeline._loop is None
+
+
+def test_pipeline_context_manager():
+    with Pipeline("test", ":memory:") as p:
+        p.add_beaker("word", Word)
+    # database is closed on exit
+    with pytest.raises(sqlite3.ProgrammingError):
+        len(p.beakers["word"])
+
+
+def test_add_beaker_redeclare_same(wc_pipeline):
+    beaker = wc_pipeline.beakers["word"]
+    beaker.add_item(Word(word="apple"), parent=None)
+    assert wc_pipeline.add_beaker("word", Word) is beaker
+    assert len(wc_pipeline.beakers["word"]) == 1
+
+
+def test_add_beaker_redeclare_conflict(wc_pipeline):
+    with pytest.raises(InvalidGraph) as e:
+        wc_pipeline.add_beaker("word", Sentence)
+    assert "Beaker word already exists as SqliteBeaker(word, Word)" in str(e)
+    with pytest.raises(InvalidGraph):
+        wc_pipeline.add_beaker("word", Word, beaker_type=TempBeaker)
+
+
+def test_run_whole_record_reuses_loaded_item(wc_pipeline, monkeypatch):
+    wc_pipeline.add_transform(
+        "word",
+        "capitalized",
+        lambda r: Word(word=r["word"].word.capitalize()),
+        whole_record=True,
+    )
+    wc_pipeline.beakers["word"].add_item(Word(word="apple"), parent=None)
+
+    def no_get_item(id):
+        raise AssertionError("item should not be re-read")
+
+    monkeypatch.setattr(wc_pipeline.beakers["word"], "get_item", no_get_item)
+    report = wc_pipeline.run(RunMode.waterfall)
+    assert report.nodes["word"]["capitalized"] == 1
+
+
+def test_run_waterfall_independent_beakers_concurrent():
+    slow_capitalized = SlowCapitalized(0.05)
+    p = Pipeline("test", ":memory:", num_workers=2)
+    p.add_beaker("word", Word)
+    p.add_beaker("left", Word)
+    p.add_beaker("right", Word)
+    p.add_transform("word", "left", lambda x: x)
+    p.add_transform("word", "right", lambda x: x)
+    # left and right are in the same generation
+    p.add_transform("left", "left_out", slow_capitalized)
+    p.add_transform("right", "right_out", slow_capitalized)
+    p.beakers["word"].add_item(Word(word="apple"), parent=None)
+
+    report = p.run(RunMode.waterfall)
+    # one item each, so left and right must have overlapped
+    assert slow_capitalized.max_in_flight == 2
+    assert report.nodes["left"]["left_out"] == 1
+    assert report.nodes["right"]["right_out"] == 1
+
+
+def test_run_waterfall_num_workers_shared_by_generation():
+    slow_capitalized = SlowCapitalized(0.01)
+    p = Pipeline("test", ":memory:", num_workers=3)
+    for name in ["a", "b", "c"]:
+        p.add_beaker(name, Word)
+        p.add_transform(name, f"{name}_out", slow_capitalized)
+        for n in range(5):
+            p.beakers[name].add_item(Word(word=f"word {n}"), parent=None)
+
+    report = p.run(RunMode.waterfall)
+    # a, b and c run concurrently, but num_workers caps them together
+    assert slow_capitalized.max_in_flight == 3
+    assert all(report.nodes[name][f"{name}_out"] == 5 for name in "abc")
+
+
+def test_beaker_lengths(wc_pipeline):
+    wc_pipeline.add_beaker("temp", Word, beaker_type=TempBeaker)
+    wc_pipeline.beakers["word"].add_item(Word(word="apple"), parent=None)
+    wc_pipeline.beakers["word"].add_item(Word(word="pear"), parent=None)
+    wc_pipeline.beakers["temp"].add_item(Word(word="fig"), parent=None)
+    assert wc_pipeline._beaker_lengths() == {"word": 2, "capitalized": 0, "temp": 1}
+
+
+def test_beaker_lengths_many_beakers():
+    p = Pipeline("test", ":memory:")
+    # more beakers than SQLite allows terms in a single compound SELECT
+    for n in range(MAX_COMPOUND_SELECT + 100):
+        p.add_beaker(f"b{n}", Word)
+    p.beakers["b550"].add_item(Word(word="apple"), parent=None)
+    lengths = p._beaker_lengths()
+    assert len(lengths) == MAX_COMPOUND_SELECT + 100
+    assert lengths["b0"] == 0
+    assert lengths["b550"] == 1
+    assert p.reset() == ["b550 (1)"]
+
+
+def test_run_waterfall_rerun_after_error():
+    def explode(word: Word) -> Word:
+        raise ZeroDivisionError("zero")
+
+    p = Pipeline("test", ":memory:")
+    p.add_beaker("a", Word)
+    p.add_beaker("b", Word)
+    # a and b are in the same generation
+    p.add_transform("a", "a_out", explode)
+    p.add_transform("b", "b_out", SlowCapitalized(0.01))
+    p.beakers["a"].add_item(Word(word="apple"), parent=None)
+    for n in range(6):
+        p.beakers["b"].add_item(Word(word=f"word {n}"), parent=None)
+
+    with pytest.raises(ZeroDivisionError):
+        p.run(RunMode.waterfall)
+
+    assert p._loop is None
+    p.delete_from_beaker("a")
+    report = p.run(RunMode.waterfall)
+    assert len(p.beakers["b_out"]) == 6
+    assert report.nodes["b"]["_already_processed"] + report.nodes["b"]["b_out"] == 6
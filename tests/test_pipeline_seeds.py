@@ -252,3 +252,24 @@ def test_run_seed_parameters_multiple_runs_identical(anagram_p):
 
     # record not updated
     assert res1 == anagram_p.get_seed_run("sr:anagrams[word=test]")
+
+
+def test_run_seed_max_items_stops_pulling():
+    pulled = 0
+
+    def fails_late():
+        nonlocal pulled
+        for n in range(100):
+            if n == 20:
+                raise ValueError("upstream blew up")
+            pulled += 1
+            yield Word(word=str(n))
+
+    p = Pipeline("seeds", ":memory:")
+    p.add_beaker("word", Word)
+    p.register_seed(fails_late, "word")
+    run = p.run_seed("fails_late", max_items=5)
+    assert pulled == 5
+    assert run.num_items == 5
+    assert run.error == ""
+    assert len(p.beakers["word"]) == 5